@@ -0,0 +1,7 @@
+def post_worker_init(worker):
+    """
+    Starts the readiness probes as soon as a worker has loaded the app,
+    so /ready does not wait for its first request to begin probing.
+    """
+    from server import readiness_monitor
+    readiness_monitor.ensure_started()
@@ -1,17 +1,30 @@
 import os
 import logging
 from datetime import datetime
-from random import Random
+from random import Random, random
 import requests
 import base64
 import json
+import functools
+import threading
+import sys
+import time
+import hmac
+import uuid
+import contextlib
+import tracemalloc
+import gzip
+import zlib
+from collections import Counter
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, g, has_request_context, send_from_directory
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from werkzeug.exceptions import BadRequest, HTTPException, RequestEntityTooLarge, UnsupportedMediaType
 
 import boto3
-from botocore.exceptions import ClientError
+from botocore.config import Config as BotoConfig
+from botocore.exceptions import BotoCoreError, ClientError
 
 from dotenv import load_dotenv
 
@@ -23,6 +36,34 @@ class Config:
     DEFAULT_RECIPIENT_EMAIL = os.getenv('DEFAULT_RECIPIENT_EMAIL', 'kyc@ethereum.org')
     NUMBER_OF_ATTACHMENTS = int(os.getenv('NUMBEROFATTACHMENTS', 10))
     SECRET_KEY = os.getenv('SECRET_KEY', 'you-should-set-a-secret-key')
+    # Memory budget for concurrent submissions. MEMORY_BUDGET_BYTES=0 derives the budget from the container memory limit.
+    MEMORY_BUDGET_BYTES = int(os.getenv('MEMORY_BUDGET_BYTES', 0))
+    MEMORY_BUDGET_FRACTION = float(os.getenv('MEMORY_BUDGET_FRACTION', 0.6))  # share of the container memory usable by submissions
+    MEMORY_BUDGET_WORKERS = int(os.getenv('WEB_CONCURRENCY', 1))  # the budget is split between gunicorn workers, which gunicorn also reads from WEB_CONCURRENCY
+    MEMORY_BUDGET_COPIES = int(os.getenv('MEMORY_BUDGET_COPIES', 4))  # request body, parsed dict, MIME object and serialized message
+    MEMORY_BUDGET_MAX_WAITERS = int(os.getenv('MEMORY_BUDGET_MAX_WAITERS', 4))
+    MEMORY_BUDGET_WAIT_TIMEOUT = float(os.getenv('MEMORY_BUDGET_WAIT_TIMEOUT', 10))
+    MEMORY_BUDGET_RETRY_AFTER = int(os.getenv('MEMORY_BUDGET_RETRY_AFTER', 30))
+    # On-demand profiling of submissions. The operator endpoints are disabled unless PROFILING_TOKEN is set.
+    PROFILING_TOKEN = os.getenv('PROFILING_TOKEN', '')
+    PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 0))  # fraction of submissions to profile
+    PROFILING_INTERVAL = float(os.getenv('PROFILING_INTERVAL', 0.005))  # seconds between stack samples
+    PROFILING_DIR = os.getenv('PROFILING_DIR', '/tmp/secure-drop-profiles')
+    PROFILING_MAX_FILES = int(os.getenv('PROFILING_MAX_FILES', 100))
+    PROFILING_TOP_ALLOCATIONS = int(os.getenv('PROFILING_TOP_ALLOCATIONS', 10))
+    # Background dependency probes backing /ready
+    READINESS_PROBE_INTERVAL = float(os.getenv('READINESS_PROBE_INTERVAL', 30))
+    READINESS_PROBE_TIMEOUT = float(os.getenv('READINESS_PROBE_TIMEOUT', 5))
+    READINESS_MAX_AGE = float(os.getenv('READINESS_MAX_AGE', 90))  # a snapshot older than this is not trusted
+    # Time budget of a submission, kept well below the gunicorn worker timeout, and per-call caps within it
+    SUBMISSION_DEADLINE = float(os.getenv('SUBMISSION_DEADLINE', 60))
+    TURNSTILE_TIMEOUT = float(os.getenv('TURNSTILE_TIMEOUT', 10))
+    SES_CONNECT_TIMEOUT = float(os.getenv('SES_CONNECT_TIMEOUT', 5))
+    SES_TIMEOUT = float(os.getenv('SES_TIMEOUT', 30))
+    KISSFLOW_TIMEOUT = float(os.getenv('KISSFLOW_TIMEOUT', 10))
+    # Circuit breakers open after this many consecutive failures and allow a trial call after the reset timeout
+    CIRCUIT_BREAKER_FAILURES = int(os.getenv('CIRCUIT_BREAKER_FAILURES', 5))
+    CIRCUIT_BREAKER_RESET_TIMEOUT = float(os.getenv('CIRCUIT_BREAKER_RESET_TIMEOUT', 30))
 
 def validate_env_vars(required_vars):
     """
@@ -32,6 +73,418 @@ def validate_env_vars(required_vars):
     if missing_vars:
         raise EnvironmentError(f"Missing required environment variables: {', '.join(missing_vars)}")
 
+def detect_memory_limit():
+    """
+    Returns the container memory limit in bytes (cgroup v2 or v1), falling back to the physical memory size.
+    """
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # cgroup v2 reports "max" and cgroup v1 a huge number when there is no limit
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError):
+        return None
+
+def get_memory_budget_capacity():
+    """
+    Computes the number of bytes a single worker may reserve for submissions in flight.
+    """
+    if Config.MEMORY_BUDGET_BYTES:
+        return Config.MEMORY_BUDGET_BYTES
+    # Without any known limit, allow a single maximum-size submission at a time
+    single_request = Config.MAX_CONTENT_LENGTH * Config.MEMORY_BUDGET_COPIES
+    memory_limit = detect_memory_limit()
+    if not memory_limit:
+        return single_request
+    worker_share = int(memory_limit * Config.MEMORY_BUDGET_FRACTION / max(Config.MEMORY_BUDGET_WORKERS, 1))
+    return max(worker_share, 1)
+
+class MemoryBudgetExceeded(Exception):
+    pass
+
+class MemoryBudget:
+    """
+    Byte-budget semaphore limiting the memory held by concurrent submissions.
+    Requests that do not fit wait in a bounded queue, or are rejected once it is full or the wait times out.
+    """
+    def __init__(self, capacity, max_waiters, wait_timeout):
+        self.capacity = capacity
+        self.max_waiters = max_waiters
+        self.wait_timeout = wait_timeout
+        self.reserved = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, nbytes):
+        """
+        Reserves nbytes of the budget and returns the amount actually reserved.
+        A request larger than the whole budget reserves all of it, so it runs alone instead of never running.
+        """
+        nbytes = min(nbytes, self.capacity)
+        with self._condition:
+            if self.waiting == 0 and self.reserved + nbytes <= self.capacity:
+                self.reserved += nbytes
+                return nbytes
+            if self.waiting >= self.max_waiters:
+                self.rejected += 1
+                raise MemoryBudgetExceeded('Memory budget queue is full')
+            self.waiting += 1
+            try:
+                admitted = self._condition.wait_for(lambda: self.reserved + nbytes <= self.capacity, timeout=self.wait_timeout)
+            finally:
+                self.waiting -= 1
+            if not admitted:
+                self.rejected += 1
+                raise MemoryBudgetExceeded('Timed out waiting for memory budget')
+            self.reserved += nbytes
+            return nbytes
+
+    def release(self, nbytes):
+        with self._condition:
+            self.reserved -= nbytes
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'capacity_bytes': self.capacity,
+                'reserved_bytes': self.reserved,
+                'available_bytes': self.capacity - self.reserved,
+                'waiting': self.waiting,
+                'rejected': self.rejected,
+            }
+
+def estimate_request_memory(content_length):
+    """
+    Estimates the peak memory a submission will use from its declared Content-Length.
+    Compressed bodies are topped up with reserve_decoded_memory once their decoded size is known.
+    """
+    if not content_length:
+        # Chunked or undeclared bodies are only bounded by MAX_CONTENT_LENGTH
+        content_length = Config.MAX_CONTENT_LENGTH
+    return min(content_length, Config.MAX_CONTENT_LENGTH) * Config.MEMORY_BUDGET_COPIES
+
+def reserve_memory_budget(view):
+    """
+    Decorator admitting a request only once its estimated memory fits in the worker's budget.
+    Responds with 503 and a Retry-After header when the budget stays exhausted.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.memory_reserved = 0
+        try:
+            g.memory_reserved = memory_budget.acquire(estimate_request_memory(request.content_length))
+            return view(*args, **kwargs)
+        except MemoryBudgetExceeded as e:
+            logging.warning(f"Rejecting submission: {str(e)}. Budget: {memory_budget.stats()}")
+            response = jsonify({'status': 'failure', 'message': 'The server is busy processing other submissions. Please try again in a minute.'})
+            response.status_code = 503
+            response.headers['Retry-After'] = str(Config.MEMORY_BUDGET_RETRY_AFTER)
+            return response
+        finally:
+            memory_budget.release(g.memory_reserved)
+    return wrapper
+
+def reserve_decoded_memory(decoded_length):
+    """
+    Tops up the reservation of the current request once the decoded size of a compressed body is known.
+    Raises MemoryBudgetExceeded like the initial admission when the difference does not fit.
+    """
+    reserved = g.get('memory_reserved')
+    if reserved is None:
+        return
+    needed = min(estimate_request_memory(decoded_length), memory_budget.capacity)
+    if needed > reserved:
+        g.memory_reserved += memory_budget.acquire(needed - reserved)
+
+PROFILING_RATE_FILE = 'sample_rate'
+PROFILE_SUFFIXES = ('.folded', '.alloc.txt')
+# Cache of the sample rate file, re-read only when its mtime changes
+profiling_settings = {'sample_rate': Config.PROFILING_SAMPLE_RATE, 'mtime': None}
+tracemalloc_lock = threading.Lock()
+tracemalloc_users = 0
+
+class RequestProfiler:
+    """
+    Statistical profiler for a single request. A background thread samples the stack of the
+    request thread and folds it per stage, while tracemalloc snapshots record allocations per stage.
+    """
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.current_stage = 'request'
+        self.stacks = Counter()
+        self.allocations = {}
+        self.durations = {}
+        self._stopped = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+
+    def start(self):
+        global tracemalloc_users
+        with tracemalloc_lock:
+            if tracemalloc_users == 0:
+                tracemalloc.start()
+            tracemalloc_users += 1
+        self._sampler.start()
+
+    def stop(self):
+        global tracemalloc_users
+        self._stopped.set()
+        self._sampler.join()
+        with tracemalloc_lock:
+            tracemalloc_users -= 1
+            if tracemalloc_users == 0:
+                tracemalloc.stop()
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            frames.append(self.current_stage)
+            self.stacks[';'.join(reversed(frames))] += 1
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        previous_stage = self.current_stage
+        self.current_stage = name
+        # Other requests profiled concurrently in this worker also show up in the allocation diff
+        before = tracemalloc.take_snapshot()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] = time.perf_counter() - started
+            after = tracemalloc.take_snapshot()
+            self.allocations[name] = after.compare_to(before, 'lineno')[:Config.PROFILING_TOP_ALLOCATIONS]
+            self.current_stage = previous_stage
+
+    def save(self, directory):
+        """
+        Writes the folded stacks (flame graph input) and the allocation top-N, then prunes old profiles.
+        """
+        os.makedirs(directory, exist_ok=True)
+        # Microseconds keep names in chronological order, which pruning relies on
+        name = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        with open(os.path.join(directory, f'{name}.folded'), 'w') as f:
+            for stack, count in self.stacks.items():
+                f.write(f'{stack} {count}\n')
+        with open(os.path.join(directory, f'{name}.alloc.txt'), 'w') as f:
+            for stage, stats in self.allocations.items():
+                f.write(f'== {stage} ({self.durations[stage] * 1000:.1f} ms)\n')
+                for stat in stats:
+                    f.write(f'{stat}\n')
+                f.write('\n')
+
+        profiles = list_profiles(directory)
+        for old_profile in profiles[:max(len(profiles) - Config.PROFILING_MAX_FILES, 0)]:
+            os.remove(os.path.join(directory, old_profile))
+        return name
+
+def get_profiling_sample_rate():
+    """
+    Returns the sample rate shared by all workers. POST /profiling stores it in PROFILING_DIR,
+    until then PROFILING_SAMPLE_RATE applies.
+    """
+    try:
+        stat = os.stat(os.path.join(Config.PROFILING_DIR, PROFILING_RATE_FILE))
+    except OSError:
+        return Config.PROFILING_SAMPLE_RATE
+    # The file is replaced on every update, so the inode changes even where mtime is coarse
+    mtime = (stat.st_ino, stat.st_mtime_ns)
+    if mtime != profiling_settings['mtime']:
+        try:
+            with open(os.path.join(Config.PROFILING_DIR, PROFILING_RATE_FILE)) as f:
+                sample_rate = float(f.read())
+        except (OSError, ValueError):
+            return Config.PROFILING_SAMPLE_RATE
+        profiling_settings.update(sample_rate=sample_rate, mtime=mtime)
+    return profiling_settings['sample_rate']
+
+def set_profiling_sample_rate(sample_rate):
+    """
+    Stores the sample rate for all workers, replacing the file atomically so readers never see a partial write.
+    """
+    os.makedirs(Config.PROFILING_DIR, exist_ok=True)
+    path = os.path.join(Config.PROFILING_DIR, PROFILING_RATE_FILE)
+    with open(f'{path}.{os.getpid()}.tmp', 'w') as f:
+        f.write(str(sample_rate))
+    os.replace(f'{path}.{os.getpid()}.tmp', path)
+
+def list_profiles(directory):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name for name in os.listdir(directory) if name.endswith(PROFILE_SUFFIXES))
+
+def profiling_stage(name):
+    """
+    Returns a context manager attributing samples and allocations to a stage of the current request.
+    It is a no-op unless the request was selected for profiling.
+    """
+    profiler = g.get('profiler') if has_request_context() else None
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.stage(name)
+
+def profile_sampled_requests(view):
+    """
+    Decorator profiling the configured fraction of requests to the view.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not Config.PROFILING_TOKEN:
+            return view(*args, **kwargs)
+        sample_rate = get_profiling_sample_rate()
+        if sample_rate <= 0 or random() >= sample_rate:
+            return view(*args, **kwargs)
+
+        profiler = RequestProfiler(threading.get_ident(), Config.PROFILING_INTERVAL)
+        g.profiler = profiler
+        profiler.start()
+        try:
+            return view(*args, **kwargs)
+        finally:
+            profiler.stop()
+            g.profiler = None
+            try:
+                name = profiler.save(Config.PROFILING_DIR)
+                logging.info(f"Saved request profile {name}")
+            except OSError as e:
+                logging.error(f"Failed to save request profile: {str(e)}")
+    return wrapper
+
+def require_profiling_token(view):
+    """
+    Decorator restricting the profiling endpoints to operators holding PROFILING_TOKEN.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not Config.PROFILING_TOKEN:
+            return jsonify({'status': 'failure', 'message': 'Not found'}), 404
+        token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if not hmac.compare_digest(token.encode(), Config.PROFILING_TOKEN.encode()):
+            return jsonify({'status': 'failure', 'message': 'Unauthorized'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+def get_content_encoding():
+    """
+    Returns the normalized Content-Encoding of the current request.
+    """
+    return request.headers.get('Content-Encoding', 'identity').strip().lower() or 'identity'
+
+def read_request_body():
+    """
+    Reads the request body, decoding a gzip Content-Encoding as it is streamed in.
+    The decoded size is limited to MAX_CONTENT_LENGTH, which guards against decompression bombs.
+    """
+    encoding = get_content_encoding()
+    if encoding == 'identity':
+        return request.get_data()
+    if encoding not in ('gzip', 'x-gzip'):
+        raise UnsupportedMediaType(f'Unsupported Content-Encoding: {encoding}')
+
+    limit = Config.MAX_CONTENT_LENGTH
+    try:
+        with gzip.GzipFile(fileobj=request.stream, mode='rb') as decoded:
+            body = decoded.read(limit + 1)
+    except (OSError, EOFError, zlib.error) as e:
+        # gzip.BadGzipFile is an OSError
+        logging.warning(f"Rejecting corrupt {encoding} encoded submission: {str(e)}")
+        raise BadRequest('Invalid gzip request body')
+    if len(body) > limit:
+        logging.warning(f"Rejecting {encoding} encoded submission exceeding {limit} bytes once decoded")
+        raise RequestEntityTooLarge()
+    reserve_decoded_memory(len(body))
+    return body
+
+class DeadlineExceeded(Exception):
+    pass
+
+class Deadline:
+    """
+    Time budget of a request, passed down so that every outbound call is bounded by what is left of it.
+    """
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+def get_timeout(deadline, cap):
+    """
+    Returns the timeout for the next outbound call, raising DeadlineExceeded if the budget is spent.
+    """
+    if deadline is None:
+        return cap
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        raise DeadlineExceeded('Request deadline exceeded')
+    return min(remaining, cap)
+
+class CircuitOpen(Exception):
+    pass
+
+class CircuitBreaker:
+    """
+    Fails calls to a dependency fast after consecutive failures.
+    Once reset_timeout has passed, a single trial call is let through to probe for recovery.
+    """
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            return 'open' if time.monotonic() - self.opened_at < self.reset_timeout else 'half-open'
+
+    def is_open(self):
+        return self.state() == 'open'
+
+    def before_call(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                raise CircuitOpen(f'{self.name} circuit breaker is open')
+            # Let this call through as the trial and keep failing others fast until it reports back
+            self.opened_at = time.monotonic()
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logging.info(f"{self.name} circuit breaker closed")
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logging.warning(f"{self.name} circuit breaker opened after {self.failures} consecutive failures")
+                self.opened_at = time.monotonic()
+
+turnstile_breaker = CircuitBreaker('Turnstile', Config.CIRCUIT_BREAKER_FAILURES, Config.CIRCUIT_BREAKER_RESET_TIMEOUT)
+ses_breaker = CircuitBreaker('SES', Config.CIRCUIT_BREAKER_FAILURES, Config.CIRCUIT_BREAKER_RESET_TIMEOUT)
+kissflow_breaker = CircuitBreaker('Kissflow', Config.CIRCUIT_BREAKER_FAILURES, Config.CIRCUIT_BREAKER_RESET_TIMEOUT)
+
 def sanitize_filename(filename):
     """
     Sanitizes the filename to prevent directory traversal and other issues.
@@ -112,7 +565,7 @@ def create_email(to_email, identifier, text, all_attachments, reference=''):
     
     return msg
 
-def validate_turnstile(turnstile_response):
+def validate_turnstile(turnstile_response, deadline=None):
     """
     Validates the Turnstile response using Cloudflare's API.
     """
@@ -121,8 +574,20 @@ def validate_turnstile(turnstile_response):
         'secret': secret_key,
         'response': turnstile_response
     }
-    response = requests.post('https://challenges.cloudflare.com/turnstile/v0/siteverify', data=payload)
-    result = response.json()
+    timeout = get_timeout(deadline, Config.TURNSTILE_TIMEOUT)
+    try:
+        turnstile_breaker.before_call()
+    except CircuitOpen:
+        logging.error("Turnstile circuit breaker is open, rejecting submission")
+        raise ValueError('Turnstile verification is temporarily unavailable. Please try again later.')
+
+    try:
+        response = requests.post('https://challenges.cloudflare.com/turnstile/v0/siteverify', data=payload, timeout=timeout)
+        result = response.json()
+    except (requests.RequestException, ValueError):
+        turnstile_breaker.record_failure()
+        raise
+    turnstile_breaker.record_success()
 
     # Log the validation result
     logging.info(f"Turnstile validation response: {result}")
@@ -132,7 +597,11 @@ def validate_turnstile(turnstile_response):
         logging.error(f"Turnstile verification failed with error codes: {error_codes}")
         raise ValueError('Turnstile verification failed.')
 
-def send_email(message):
+# Error codes SES answers with when the sending rate is exceeded
+SES_THROTTLING_CODES = ('Throttling', 'ThrottlingException', 'TooManyRequestsException', 'LimitExceededException')
+
+
+def send_email(message, deadline=None):
     """
     Sends the email using AWS SES V2 and logs detailed information for debugging.
     """
@@ -148,6 +617,11 @@ def send_email(message):
         
         logging.info(f'Sending email with size: {message_size_mb:.2f} MB')
         
+        # boto3 has no per-call timeout, so only start the single attempt if its worst case fits in the budget
+        if deadline is not None and deadline.remaining() < Config.SES_CONNECT_TIMEOUT + Config.SES_TIMEOUT:
+            raise DeadlineExceeded(f'Only {deadline.remaining():.1f}s left to send the email')
+        ses_breaker.before_call()
+
         # Send the email using SES V2
         response = ses_client.send_email(
             FromEmailAddress=message['From'],
@@ -161,6 +635,8 @@ def send_email(message):
             }
         )
         
+        ses_breaker.record_success()
+
         # Log the response
         message_id = response['MessageId']
         logging.info('AWS SES V2 email sent successfully. MessageId: %s', message_id)
@@ -169,6 +645,9 @@ def send_email(message):
         error_code = e.response['Error']['Code']
         error_message = e.response['Error']['Message']
         logging.error('AWS SES V2 error: Code=%s, Message=%s', error_code, error_message)
+        # Oversized messages and throttling during a burst say nothing about the health of SES
+        if error_code not in ('413', 'RequestEntityTooLarge') + SES_THROTTLING_CODES:
+            ses_breaker.record_failure()
         
         # Provide user-friendly error messages
         if error_code == '413' or error_code == 'RequestEntityTooLarge':
@@ -176,6 +655,8 @@ def send_email(message):
             message_size_mb = len(raw_message_data) / (1024 * 1024)
             logging.error(f'Email message size: {message_size_mb:.2f} MB')
             raise ValueError('Error: Email message is too large. AWS SES has a 40MB limit for raw messages. Please reduce the size of attachments.')
+        elif error_code in SES_THROTTLING_CODES:
+            raise ValueError('Error: Email delivery is busy. Please try again in a minute.')
         elif error_code == 'MessageRejected':
             raise ValueError('Error: Email was rejected by AWS SES. Please check the email configuration.')
         elif error_code == 'MailFromDomainNotVerified':
@@ -188,7 +669,12 @@ def send_email(message):
             raise ValueError('Error: AWS SES sending is paused for this account.')
         else:
             raise ValueError(f'Error: Failed to send email. {error_message}')
-            
+
+    except BotoCoreError as e:
+        logging.error('AWS SES V2 connection error: %s', str(e))
+        ses_breaker.record_failure()
+        raise
+
     except Exception as e:
         logging.error('Error sending email via AWS SES V2: %s', str(e))
         raise
@@ -209,27 +695,60 @@ def get_forwarded_address():
     # Otherwise use the default function
     return get_remote_address()
 
-def find_aog_item_by_grant_id(grant_id):
+def get_kissflow_config():
+    """
+    Reads the Kissflow configuration from the environment.
+    Returns None if the integration is not configured.
+    """
+    subdomain = os.getenv('KISSFLOW_SUBDOMAIN', 'ethereum')
+    access_key_id = os.getenv('KISSFLOW_ACCESS_KEY_ID')
+    access_key_secret = os.getenv('KISSFLOW_ACCESS_KEY_SECRET')
+    account_id = os.getenv('KISSFLOW_ACCOUNT_ID')
+    process_id = os.getenv('KISSFLOW_PROCESS_ID')
+
+    if not all([access_key_id, access_key_secret, account_id, process_id]):
+        return None
+
+    return {
+        'process_url': f"https://{subdomain}.kissflow.com/process/2/{account_id}/admin/{process_id}",
+        'access_key_id': access_key_id,
+        'access_key_secret': access_key_secret
+    }
+
+def kissflow_request(method, url, deadline=None, **kwargs):
+    """
+    Sends a Kissflow API request bounded by the deadline and tracked by the Kissflow circuit breaker.
+    """
+    # An exhausted deadline must not take the half-open trial slot without reporting back
+    timeout = get_timeout(deadline, Config.KISSFLOW_TIMEOUT)
+    kissflow_breaker.before_call()
+    try:
+        response = requests.request(method, url, timeout=timeout, **kwargs)
+    except requests.RequestException:
+        kissflow_breaker.record_failure()
+        raise
+    if response.status_code >= 500 or response.status_code in (401, 403, 429):
+        kissflow_breaker.record_failure()
+    else:
+        kissflow_breaker.record_success()
+    return response
+
+def find_aog_item_by_grant_id(grant_id, deadline=None):
     """
     Finds an AOG (Approval of Grants) item in Kissflow by Grant ID.
     Uses the admin endpoint to get all items and searches through them.
     Returns the item ID if found, None otherwise.
     """
     try:
-        subdomain = os.getenv('KISSFLOW_SUBDOMAIN', 'ethereum')
-        access_key_id = os.getenv('KISSFLOW_ACCESS_KEY_ID')
-        access_key_secret = os.getenv('KISSFLOW_ACCESS_KEY_SECRET')
-        account_id = os.getenv('KISSFLOW_ACCOUNT_ID')
-        process_id = os.getenv('KISSFLOW_PROCESS_ID')
-        
-        if not all([access_key_id, access_key_secret, account_id, process_id]):
+        kissflow = get_kissflow_config()
+        if kissflow is None:
             logging.error("Missing Kissflow configuration")
             return None
         
         headers = {
             'Accept': 'application/json',
-            'X-Access-Key-Id': access_key_id,
-            'X-Access-Key-Secret': access_key_secret
+            'X-Access-Key-Id': kissflow['access_key_id'],
+            'X-Access-Key-Secret': kissflow['access_key_secret']
         }
         
         # Use admin endpoint to get all items
@@ -238,7 +757,7 @@ def find_aog_item_by_grant_id(grant_id):
         
         while True:
             # Kissflow admin API endpoint to get all items
-            url = f"https://{subdomain}.kissflow.com/process/2/{account_id}/admin/{process_id}/item"
+            url = f"{kissflow['process_url']}/item"
             
             params = {
                 'page_number': page_number,
@@ -246,7 +765,7 @@ def find_aog_item_by_grant_id(grant_id):
                 'apply_preference': False
             }
             
-            response = requests.get(url, headers=headers, params=params)
+            response = kissflow_request('GET', url, deadline, headers=headers, params=params)
             
             if response.status_code != 200:
                 logging.error(f"Kissflow API error: {response.status_code} - {response.text}")
@@ -298,19 +817,14 @@ def find_aog_item_by_grant_id(grant_id):
     
     return None
 
-def update_aog_kyc_comments(item_id, legal_identifier):
+def update_aog_kyc_comments(item_id, legal_identifier, deadline=None):
     """
     Updates the KYC_Comments field in a Kissflow AOG item with the legal identifier.
     Uses the admin PUT endpoint to update item details.
     """
     try:
-        subdomain = os.getenv('KISSFLOW_SUBDOMAIN', 'ethereum')
-        access_key_id = os.getenv('KISSFLOW_ACCESS_KEY_ID')
-        access_key_secret = os.getenv('KISSFLOW_ACCESS_KEY_SECRET')
-        account_id = os.getenv('KISSFLOW_ACCOUNT_ID')
-        process_id = os.getenv('KISSFLOW_PROCESS_ID')
-        
-        if not all([access_key_id, access_key_secret, account_id, process_id]):
+        kissflow = get_kissflow_config()
+        if kissflow is None:
             logging.error("Missing Kissflow configuration")
             return False
         
@@ -318,13 +832,13 @@ def update_aog_kyc_comments(item_id, legal_identifier):
         headers = {
             'Accept': 'application/json',
             'Content-Type': 'application/json',
-            'X-Access-Key-Id': access_key_id,
-            'X-Access-Key-Secret': access_key_secret
+            'X-Access-Key-Id': kissflow['access_key_id'],
+            'X-Access-Key-Secret': kissflow['access_key_secret']
         }
         
         # Get current item details using admin endpoint
-        get_url = f"https://{subdomain}.kissflow.com/process/2/{account_id}/admin/{process_id}/{item_id}"
-        get_response = requests.get(get_url, headers=headers)
+        get_url = f"{kissflow['process_url']}/{item_id}"
+        get_response = kissflow_request('GET', get_url, deadline, headers=headers)
         
         if get_response.status_code != 200:
             logging.error(f"Failed to get current item details: {get_response.status_code} - {get_response.text}")
@@ -353,9 +867,9 @@ def update_aog_kyc_comments(item_id, legal_identifier):
         filtered_item = {k: v for k, v in current_item.items() if not k.startswith('_')}
         
         # Use admin PUT endpoint to update the item
-        put_url = f"https://{subdomain}.kissflow.com/process/2/{account_id}/admin/{process_id}/{item_id}"
+        put_url = f"{kissflow['process_url']}/{item_id}"
         
-        response = requests.put(put_url, headers=headers, json=filtered_item)
+        response = kissflow_request('PUT', put_url, deadline, headers=headers, json=filtered_item)
         
         if response.status_code == 200:
             logging.info(f"Successfully updated AOG item {item_id} with legal identifier {legal_identifier}")
@@ -368,26 +882,130 @@ def update_aog_kyc_comments(item_id, legal_identifier):
     
     return False
 
-def send_identifier_to_kissflow(grant_id, legal_identifier):
+def send_identifier_to_kissflow(grant_id, legal_identifier, deadline=None):
     """
     Sends the legal identifier to the Kissflow AOG item based on Grant ID.
+    The update is optional, so it is skipped while Kissflow is degraded.
     """
     if not grant_id:
         logging.warning("No Grant ID provided, skipping Kissflow update")
         return False
+
+    if kissflow_breaker.is_open():
+        logging.warning("Kissflow circuit breaker is open, skipping Kissflow update")
+        return False
     
     # Find the AOG item by Grant ID
-    item_id = find_aog_item_by_grant_id(grant_id)
+    with profiling_stage('find_aog_item_by_grant_id'):
+        item_id = find_aog_item_by_grant_id(grant_id, deadline)
     
     if not item_id:
         logging.warning(f"No AOG item found for Grant ID: {grant_id}")
         return False
     
     # Update the KYC_Comments field
-    success = update_aog_kyc_comments(item_id, legal_identifier)
+    success = update_aog_kyc_comments(item_id, legal_identifier, deadline)
     
     return success
 
+def probe_ses():
+    """
+    Checks that the SES account can send and has not exhausted its daily quota.
+    """
+    account = ses_probe_client.get_account()
+    quota = account.get('SendQuota', {})
+    sending_enabled = account.get('SendingEnabled', False)
+    enforcement_status = account.get('EnforcementStatus', '')
+    max_send = quota.get('Max24HourSend', 0)
+    # A quota of -1 means sending is unlimited
+    quota_left = max_send < 0 or max_send > quota.get('SentLast24Hours', 0)
+    return {
+        'ok': sending_enabled and enforcement_status != 'SHUTDOWN' and quota_left,
+        'sending_enabled': sending_enabled,
+        'enforcement_status': enforcement_status,
+        'max_24_hour_send': quota.get('Max24HourSend'),
+        'sent_last_24_hours': quota.get('SentLast24Hours')
+    }
+
+def probe_kissflow():
+    """
+    Checks the Kissflow credentials against the item listing endpoint used by find_aog_item_by_grant_id.
+    """
+    kissflow = get_kissflow_config()
+    if kissflow is None:
+        return {'ok': True, 'skipped': 'not configured'}
+
+    headers = {
+        'Accept': 'application/json',
+        'X-Access-Key-Id': kissflow['access_key_id'],
+        'X-Access-Key-Secret': kissflow['access_key_secret']
+    }
+    params = {'page_number': 1, 'page_size': 1, 'apply_preference': False}
+    response = requests.get(f"{kissflow['process_url']}/item", headers=headers, params=params, timeout=Config.READINESS_PROBE_TIMEOUT)
+    return {'ok': response.status_code == 200, 'status_code': response.status_code}
+
+def probe_turnstile():
+    """
+    Checks that the Turnstile verification API is reachable. An empty token is expected to be rejected.
+    """
+    payload = {'secret': TURNSTILE_SECRET_KEY, 'response': ''}
+    response = requests.post('https://challenges.cloudflare.com/turnstile/v0/siteverify', data=payload, timeout=Config.READINESS_PROBE_TIMEOUT)
+    result = response.json()
+    return {'ok': response.status_code == 200 and 'success' in result, 'status_code': response.status_code}
+
+class ReadinessMonitor:
+    """
+    Probes dependencies from a background thread and keeps the latest results in memory,
+    so readiness checks are answered without calling third parties.
+    Failing non-critical probes are reported but do not make the worker unready.
+    """
+    def __init__(self, probes, interval, max_age):
+        self.probes = probes
+        self.interval = interval
+        self.max_age = max_age
+        self.snapshot = None
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def ensure_started(self):
+        # Threads do not survive a fork, so each worker process starts its own probe loop
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            self.refresh()
+            time.sleep(self.interval)
+
+    def refresh(self):
+        results = {}
+        for name, (probe, critical) in self.probes.items():
+            started = time.perf_counter()
+            try:
+                result = probe()
+            except Exception as e:
+                result = {'ok': False, 'error': str(e)}
+            result['latency_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            result['critical'] = critical
+            if not result['ok']:
+                logging.warning(f"Readiness probe {name} failed: {result}")
+            results[name] = result
+        self.snapshot = {'checked_at': time.time(), 'probes': results}
+
+    def status(self):
+        """
+        Returns whether the worker is ready, along with the snapshot it was decided from.
+        """
+        snapshot = self.snapshot
+        if snapshot is None:
+            return False, {'status': 'starting'}
+        age = time.time() - snapshot['checked_at']
+        ready = age <= self.max_age and all(result['ok'] for result in snapshot['probes'].values() if result['critical'])
+        return ready, {'status': 'ready' if ready else 'unready', 'age_seconds': round(age, 1), 'probes': snapshot['probes']}
+
 # Validate required environment variables
 required_env_vars = ['TURNSTILE_SITE_KEY', 'TURNSTILE_SECRET_KEY', 'AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_REGION', 'SES_FROM_EMAIL']
 validate_env_vars(required_env_vars)
@@ -404,12 +1022,30 @@ ses_client = boto3.client(
     'sesv2',
     region_name=AWS_REGION,
     aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY
+    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+    config=BotoConfig(connect_timeout=Config.SES_CONNECT_TIMEOUT, read_timeout=Config.SES_TIMEOUT, retries={'total_max_attempts': 1})
+)
+
+# Readiness probes get their own client so they are bounded by READINESS_PROBE_TIMEOUT and never retried
+ses_probe_client = boto3.client(
+    'sesv2',
+    region_name=AWS_REGION,
+    aws_access_key_id=AWS_ACCESS_KEY_ID,
+    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+    config=BotoConfig(connect_timeout=Config.READINESS_PROBE_TIMEOUT, read_timeout=Config.READINESS_PROBE_TIMEOUT, retries={'total_max_attempts': 1})
 )
 
 app = Flask(__name__)
 app.config.from_object(Config)
 
+readiness_monitor = ReadinessMonitor({
+    'ses': (probe_ses, True),
+    'turnstile': (probe_turnstile, True),
+    'kissflow': (probe_kissflow, False),  # optional integration, submissions succeed without it
+}, Config.READINESS_PROBE_INTERVAL, Config.READINESS_MAX_AGE)
+
+memory_budget = MemoryBudget(get_memory_budget_capacity(), Config.MEMORY_BUDGET_MAX_WAITERS, Config.MEMORY_BUDGET_WAIT_TIMEOUT)
+
 # Initialize rate limiting
 limiter = Limiter(get_forwarded_address, app=app, default_limits=["200 per day", "50 per hour"])
 
@@ -427,12 +1063,22 @@ logging.info(f"EMAIL_DOMAIN: {Config.EMAIL_DOMAIN}")
 logging.info(f"DEFAULT_RECIPIENT_EMAIL: {Config.DEFAULT_RECIPIENT_EMAIL}")
 logging.info(f"NUMBER_OF_ATTACHMENTS: {Config.NUMBER_OF_ATTACHMENTS}")
 logging.info(f"SECRET_KEY: {'[SET]' if Config.SECRET_KEY != 'you-should-set-a-secret-key' else '[USING DEFAULT - PLEASE SET!]'}")
+logging.info(f"MEMORY_BUDGET: {memory_budget.capacity} bytes, max waiters: {memory_budget.max_waiters}, wait timeout: {memory_budget.wait_timeout}s")
 logging.info("=====================================")
 
 @app.route('/health', methods=['GET'])
 @limiter.exempt
 def health():
-    return jsonify({'status': 'ok'}), 200
+    return jsonify({'status': 'ok', 'memory_budget': memory_budget.stats()}), 200
+
+@app.route('/ready', methods=['GET'])
+@limiter.exempt
+def ready():
+    # Normally started when the worker boots (see gunicorn.conf.py), this covers other servers
+    readiness_monitor.ensure_started()
+    is_ready, body = readiness_monitor.status()
+    body['circuit_breakers'] = {breaker.name: breaker.state() for breaker in (turnstile_breaker, ses_breaker, kissflow_breaker)}
+    return jsonify(body), 200 if is_ready else 503
 
 @app.route('/', methods=['GET'])
 def index():
@@ -440,10 +1086,16 @@ def index():
 
 @app.route('/submit-encrypted-data', methods=['POST'])
 @limiter.limit("3 per minute")
+@reserve_memory_budget
+@profile_sampled_requests
 def submit():
     try:
         # Parse JSON data from request
-        data = request.get_json()
+        with profiling_stage('parse_request'):
+            data = json.loads(read_request_body())
+
+        # The deadline only covers outbound calls, a slow upload must not eat into the email budget
+        deadline = Deadline(Config.SUBMISSION_DEADLINE)
 
         # Validate Turnstile
         turnstile_response = data.get('cf-turnstile-response', '')
@@ -452,7 +1104,7 @@ def submit():
             return jsonify({'status': 'failure', 'message': 'Missing Turnstile token'}), 400
 
         try:
-            validate_turnstile(turnstile_response)
+            validate_turnstile(turnstile_response, deadline)
         except ValueError as e:
             return jsonify({'status': 'failure', 'message': str(e)}), 400
 
@@ -476,13 +1128,18 @@ def submit():
             log_data += f", reference: {reference}"
         logging.info(log_data)
 
-        message = create_email(to_email, identifier, message, files, reference)
+        with profiling_stage('create_email'):
+            message = create_email(to_email, identifier, message, files, reference)
 
-        send_email(message)
+        with profiling_stage('send_email'):
+            try:
+                send_email(message, deadline)
+            except CircuitOpen:
+                return jsonify({'status': 'failure', 'message': 'Email delivery is temporarily unavailable. Please try again later.'}), 503
 
         # If this is a legal submission with a Grant ID (reference), send to Kissflow
         if recipient == 'legal' and reference:
-            kissflow_success = send_identifier_to_kissflow(reference, identifier)
+            kissflow_success = send_identifier_to_kissflow(reference, identifier, deadline)
             if kissflow_success:
                 logging.info(f"Successfully sent identifier {identifier} to Kissflow for Grant ID {reference}")
             else:
@@ -494,11 +1151,38 @@ def submit():
 
         return jsonify({'status': 'success', 'message': notice})
 
+    except (HTTPException, MemoryBudgetExceeded):
+        # Oversized or undecodable bodies, and bodies too large for the memory budget once decoded,
+        # are answered with their own status code
+        raise
     except Exception as e:
         error_message = "An unexpected error occurred. Please try again later."
         logging.error(f"Internal error: {str(e)}")
         return jsonify({'status': 'failure', 'message': error_message})
 
+@app.route('/profiling', methods=['GET', 'POST'])
+@require_profiling_token
+def profiling():
+    """
+    Shows or updates the profiling sample rate shared by all workers and lists the stored profiles.
+    """
+    if request.method == 'POST':
+        try:
+            sample_rate = float(request.get_json().get('sample_rate', 0))
+        except (AttributeError, TypeError, ValueError):
+            sample_rate = -1
+        if not 0 <= sample_rate <= 1:
+            return jsonify({'status': 'failure', 'message': 'sample_rate must be between 0 and 1'}), 400
+        set_profiling_sample_rate(sample_rate)
+        logging.info(f"Profiling sample rate set to {sample_rate}")
+
+    return jsonify({'status': 'ok', 'sample_rate': get_profiling_sample_rate(), 'profiles': list_profiles(Config.PROFILING_DIR)})
+
+@app.route('/profiling/<path:filename>', methods=['GET'])
+@require_profiling_token
+def profiling_file(filename):
+    return send_from_directory(Config.PROFILING_DIR, filename, mimetype='text/plain')
+
 @app.errorhandler(429)
 def rate_limit_exceeded(e):
     """
@@ -515,4 +1199,5 @@ def error413(e):
     return render_template('413.html'), 413
 
 if __name__ == '__main__':
+    readiness_monitor.ensure_started()
     app.run()
@@ -253,12 +253,22 @@ function captchaExpired() {
 }
 
 async function postData(url = '/', data = {}) {
+	const headers = {
+		'Content-Type': 'application/json'
+	};
+	let body = JSON.stringify(data);
+
+	// Armored PGP data compresses well, so gzip the upload where the browser supports it
+	if (typeof CompressionStream !== 'undefined') {
+		const compressed = new Blob([body]).stream().pipeThrough(new CompressionStream('gzip'));
+		body = await new Response(compressed).blob();
+		headers['Content-Encoding'] = 'gzip';
+	}
+
 	const response = await fetch(url, {
 	  method: 'POST',
-	  headers: {
-		'Content-Type': 'application/json'
-	  },
-	  body: JSON.stringify(data)
+	  headers: headers,
+	  body: body
 	});
 	return response.json();
 }
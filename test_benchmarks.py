@@ -0,0 +1,187 @@
+"""
+Micro-benchmarks for the submission pipeline functions.
+
+Each benchmark measures the best per-call wall time over a few rounds and the peak traced memory of one run,
+and fails when either exceeds the stored baseline by more than the allowed relative threshold.
+The benchmarks are deselected by default because wall time depends on the machine and its load,
+run them with `pytest -m benchmark` and BENCHMARK_UPDATE_BASELINE=1 to record a new baseline.
+"""
+
+from os import environ
+
+environ.setdefault("TURNSTILE_SITE_KEY", "testturnstilesitekey")
+environ.setdefault("TURNSTILE_SECRET_KEY", "testturnstilesecretkey")
+environ.setdefault("AWS_ACCESS_KEY_ID", "testawsaccesskeyid")
+environ.setdefault("AWS_SECRET_ACCESS_KEY", "testawssecretaccesskey")
+environ.setdefault("AWS_REGION", "us-east-1")
+environ.setdefault("SES_FROM_EMAIL", "person@sender.org")
+
+import json
+import os
+import timeit
+import tracemalloc
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.benchmark
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+UPDATE_BASELINE = environ.get('BENCHMARK_UPDATE_BASELINE') == '1'
+TIME_THRESHOLD = float(environ.get('BENCHMARK_TIME_THRESHOLD', 2.0))
+MEMORY_THRESHOLD = float(environ.get('BENCHMARK_MEMORY_THRESHOLD', 1.25))
+# Each round calls the function often enough to run for at least 0.2s, so fast functions are averaged over
+# many calls and a single scheduler hiccup cannot double their time
+REPEAT = 5
+
+PAYLOAD_SIZES = {
+    '64kb': 64 * 1024,
+    '1mb': 1024 * 1024,
+    '8mb': 8 * 1024 * 1024,
+}
+KISSFLOW_ITEM_COUNTS = [100, 1000, 5000]
+
+
+def measure(func):
+    """
+    Returns the best per-call wall time over REPEAT rounds and the peak traced memory of a separate run.
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(REPEAT, number)) / number
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def check_against_baseline(name, seconds, peak_bytes):
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as f:
+            baseline = json.load(f)
+
+    if UPDATE_BASELINE:
+        baseline[name] = {'seconds': float(f'{seconds:.4g}'), 'peak_bytes': peak_bytes}
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        return
+
+    if name not in baseline:
+        pytest.skip(f'No baseline for {name}, run with BENCHMARK_UPDATE_BASELINE=1 to record one')
+
+    expected = baseline[name]
+    assert seconds <= expected['seconds'] * TIME_THRESHOLD, \
+        f"{name} took {seconds * 1000:.3f} ms, baseline is {expected['seconds'] * 1000:.3f} ms"
+    assert peak_bytes <= expected['peak_bytes'] * MEMORY_THRESHOLD, \
+        f"{name} peaked at {peak_bytes} bytes, baseline is {expected['peak_bytes']} bytes"
+
+
+def make_files(total_size, count=4):
+    """
+    Builds armored-looking attachments adding up to roughly total_size characters.
+    """
+    line = 'wcFMA8Gq1f0pDMnJAQ//WvY1x3E2u8Xo0bH7qFZ6m1d9hK4rLp2sT3nV5wQyR8cE0aB6\n'
+    chunk = line * (total_size // count // len(line) + 1)
+    return [{'filename': f'file{i}.txt', 'attachment': chunk[:total_size // count]} for i in range(count)]
+
+
+class StubSesClient:
+    def __init__(self):
+        self.sent_bytes = 0
+
+    def send_email(self, **kwargs):
+        self.sent_bytes = len(kwargs['Content']['Raw']['Data'])
+        return {'MessageId': 'stub-message-id'}
+
+
+@pytest.fixture
+def ses_stub(monkeypatch):
+    stub = StubSesClient()
+    monkeypatch.setattr(server, 'ses_client', stub)
+    return stub
+
+
+class StubKissflowResponse:
+    status_code = 200
+
+    def __init__(self, body):
+        self.text = body
+
+    def json(self):
+        return json.loads(self.text)
+
+
+@pytest.fixture
+def kissflow_stub(monkeypatch):
+    """
+    Answers the Kissflow admin item listing with pre-serialized pages instead of going over HTTP,
+    so the benchmark measures pagination, decoding and matching rather than the network stack.
+    """
+    monkeypatch.setenv('KISSFLOW_ACCESS_KEY_ID', 'testaccesskeyid')
+    monkeypatch.setenv('KISSFLOW_ACCESS_KEY_SECRET', 'testaccesskeysecret')
+    monkeypatch.setenv('KISSFLOW_ACCOUNT_ID', 'testaccount')
+    monkeypatch.setenv('KISSFLOW_PROCESS_ID', 'testprocess')
+
+    def start(item_count):
+        items = [
+            {'_id': f'item-{i}', '_created_by': 'someone', 'Request_number': f'GRANT-{i}', 'KYC_Comments': ''}
+            for i in range(item_count)
+        ]
+        pages = {}
+
+        def request(method, url, params=None, **kwargs):
+            key = (params['page_number'], params['page_size'])
+            if key not in pages:
+                page = items[(key[0] - 1) * key[1]:key[0] * key[1]]
+                pages[key] = json.dumps({'Data': page})
+            return StubKissflowResponse(pages[key])
+
+        monkeypatch.setattr(server.requests, 'request', request)
+
+    return start
+
+
+def test_parse_form_benchmark():
+    # parse_form only copies references to the attachment strings, so its cost does not depend on their size
+    form = {'message': 'hello', 'recipient': 'legal', 'reference': 'GRANT-1'}
+    for i, item in enumerate(make_files(PAYLOAD_SIZES['64kb'])):
+        form[f'filename-{i}'] = item['filename']
+        form[f'attachment-{i}'] = item['attachment']
+
+    seconds, peak_bytes = measure(lambda: server.parse_form(form))
+    check_against_baseline('parse_form', seconds, peak_bytes)
+
+
+@pytest.mark.parametrize('size', PAYLOAD_SIZES)
+def test_create_email_benchmark(size):
+    files = make_files(PAYLOAD_SIZES[size])
+
+    seconds, peak_bytes = measure(lambda: server.create_email('kyc@ethereum.org', 'legal:2025:01:01:00:00:00:1234', 'hello', files, 'GRANT-1'))
+    check_against_baseline(f'create_email[{size}]', seconds, peak_bytes)
+
+
+@pytest.mark.parametrize('size', PAYLOAD_SIZES)
+def test_send_email_benchmark(size, ses_stub):
+    message = server.create_email('kyc@ethereum.org', 'legal:2025:01:01:00:00:00:1234', 'hello', make_files(PAYLOAD_SIZES[size]), 'GRANT-1')
+
+    seconds, peak_bytes = measure(lambda: server.send_email(message))
+    assert ses_stub.sent_bytes > PAYLOAD_SIZES[size]
+    check_against_baseline(f'send_email[{size}]', seconds, peak_bytes)
+
+
+@pytest.mark.parametrize('item_count', KISSFLOW_ITEM_COUNTS)
+def test_find_aog_item_by_grant_id_benchmark(item_count, kissflow_stub):
+    kissflow_stub(item_count)
+    # The last item is the worst case, every page has to be fetched and scanned
+    grant_id = f'GRANT-{item_count - 1}'
+
+    assert f'item-{item_count - 1}' == server.find_aog_item_by_grant_id(grant_id)
+    seconds, peak_bytes = measure(lambda: server.find_aog_item_by_grant_id(grant_id))
+    check_against_baseline(f'find_aog_item_by_grant_id[{item_count}]', seconds, peak_bytes)
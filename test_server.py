@@ -1,78 +1,557 @@
 from os import environ
 
-environ.setdefault("SENDGRIDFROMEMAIL", "person@sender.org")
-environ.setdefault("SENDGRIDAPIKEY", "testsendgridapikey")
-environ.setdefault("RECAPTCHASITEKEY", "testrecaptchasitekey")
-environ.setdefault("RECAPTCHASECRETKEY", "testrecaptchasecretkey")
+environ.setdefault("TURNSTILE_SITE_KEY", "testturnstilesitekey")
+environ.setdefault("TURNSTILE_SECRET_KEY", "testturnstilesecretkey")
+environ.setdefault("AWS_ACCESS_KEY_ID", "testawsaccesskeyid")
+environ.setdefault("AWS_SECRET_ACCESS_KEY", "testawssecretaccesskey")
+environ.setdefault("AWS_REGION", "us-east-1")
+environ.setdefault("SES_FROM_EMAIL", "person@sender.org")
 environ.setdefault("NUMBEROFATTACHMENTS", "2")
 
+import gzip
+import json
+import threading
+import time
+import tracemalloc
 from datetime import datetime
+
+import pytest
+from botocore.exceptions import ClientError
+
 import server
 
-form = {
-    'message': 'hello',
-    'recipient': 'a@a.a',
-
-    'filename-0': 'file0.txt',
-    'attachment-0': 'content0',
-    'filename-1': 'file1.txt',
-    'attachment-1': 'content1',
-}
-text, recipient, all_attachments = server.parse_form(form)
-assert 'hello' == text
-assert 'a@a.a' == recipient
-assert [
-    ('file0.txt', 'content0'),
-    ('file1.txt', 'content1'),
-] == all_attachments
-
-# empty attachment fields are omitted
-form['attachment-1'] = ''
-text, recipient, all_attachments = server.parse_form(form)
-assert [
-    ('file0.txt', 'content0'),
-] == all_attachments
-
-
-assert server.valid_recipient('legal')
-assert not server.valid_recipient('nonlegal')
-
-assert 'devcon:2023:01:01:12:00:00:123' == server.get_identifier('devcon', datetime(2023, 1, 1, 12), 123)
-
-toEmail = 'someone@somewhere.org'
-identifier = 'just:some:identifier'
-text = 'encrypted_blablabla'
-all_attachments = [
-    ('myfile.txt', 'encrypted_file_content'),
-]
-
-email = server.create_email(toEmail, identifier, text, all_attachments)
-
-assert server.FROMEMAIL == email.from_email.email
-assert toEmail == email.personalizations[0].tos[0]['email']
-assert "Secure Form Submission just:some:identifier" == email.subject.subject
-assert text == email.contents[0].content
-assert 1 == len(email.attachments)
-
-a = email.attachments[0]
-assert "myfile.txt.pgp" == a.file_name.file_name
-assert "application/pgp-encrypted" == a.file_type.file_type
-assert "ZW5jcnlwdGVkX2ZpbGVfY29udGVudA==" == a.file_content.file_content
-
-two_attachments = [
-    ('myfile1.txt', 'encrypted_file_content1'),
-    ('myfile2.txt', 'encrypted_file_content2'),
-]
-
-email = server.create_email(toEmail, identifier, text, two_attachments)
-
-a0 = email.attachments[0]
-assert "myfile2.txt.pgp" == a0.file_name.file_name
-assert "application/pgp-encrypted" == a0.file_type.file_type
-assert "ZW5jcnlwdGVkX2ZpbGVfY29udGVudDI=" == a0.file_content.file_content
-
-a1 = email.attachments[1]
-assert "myfile1.txt.pgp" == a1.file_name.file_name
-assert "application/pgp-encrypted" == a1.file_type.file_type
-assert "ZW5jcnlwdGVkX2ZpbGVfY29udGVudDE=" == a1.file_content.file_content
 
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(server.limiter, 'enabled', False)
+    return server.app.test_client()
+
+
+def test_parse_form():
+    form = {
+        'message': 'hello',
+        'recipient': 'a@a.a',
+        'reference': 'ref',
+
+        'filename-0': 'file0.txt',
+        'attachment-0': 'content0',
+        'filename-1': 'file1.txt',
+        'attachment-1': 'content1',
+    }
+    text, recipient, reference, all_attachments = server.parse_form(form)
+    assert 'hello' == text
+    assert 'a@a.a' == recipient
+    assert 'ref' == reference
+    assert [
+        ('file0.txt', 'content0'),
+        ('file1.txt', 'content1'),
+    ] == all_attachments
+
+    # empty attachment fields are omitted
+    form['attachment-1'] = ''
+    text, recipient, reference, all_attachments = server.parse_form(form)
+    assert [
+        ('file0.txt', 'content0'),
+    ] == all_attachments
+
+
+def test_valid_recipient():
+    assert server.valid_recipient('legal')
+    assert not server.valid_recipient('nonlegal')
+
+
+def test_get_identifier():
+    assert 'devcon:2023:01:01:12:00:00:123' == server.get_identifier('devcon', datetime(2023, 1, 1, 12), 123)
+
+
+def test_create_email():
+    toEmail = 'someone@somewhere.org'
+    identifier = 'just:some:identifier'
+    text = 'encrypted_blablabla'
+    all_attachments = [
+        {'filename': 'myfile.txt', 'attachment': 'encrypted_file_content'},
+    ]
+
+    email = server.create_email(toEmail, identifier, text, all_attachments)
+
+    assert server.FROMEMAIL == email['From']
+    assert toEmail == email['To']
+    assert "Secure Form Submission just:some:identifier" == email['Subject']
+
+    body, attachment = email.get_payload()
+    assert text == body.get_payload()
+    assert "myfile.txt.pgp" == attachment.get_filename()
+    assert b"encrypted_file_content" == attachment.get_payload(decode=True)
+
+
+def test_create_email_with_reference_and_two_attachments():
+    two_attachments = [
+        {'filename': 'myfile1.txt', 'attachment': 'encrypted_file_content1'},
+        {'filename': 'myfile2.txt', 'attachment': 'encrypted_file_content2'},
+    ]
+
+    email = server.create_email('someone@somewhere.org', 'just:some:identifier', 'line1<br />line2', two_attachments, 'GRANT-1')
+
+    assert "GRANT-1 Secure Form Submission just:some:identifier" == email['Subject']
+
+    body, a0, a1 = email.get_payload()
+    assert "line1\nline2" == body.get_payload()
+    assert "myfile1.txt.pgp" == a0.get_filename()
+    assert b"encrypted_file_content1" == a0.get_payload(decode=True)
+    assert "myfile2.txt.pgp" == a1.get_filename()
+    assert b"encrypted_file_content2" == a1.get_payload(decode=True)
+
+
+def test_memory_budget_admits_immediately_when_it_fits():
+    budget = server.MemoryBudget(100, 1, 1)
+    assert 60 == budget.acquire(60)
+    assert 40 == budget.acquire(40)
+    assert {'capacity_bytes': 100, 'reserved_bytes': 100, 'available_bytes': 0, 'waiting': 0, 'rejected': 0} == budget.stats()
+
+
+def test_memory_budget_clamps_oversize_requests_to_capacity():
+    budget = server.MemoryBudget(100, 1, 1)
+    assert 100 == budget.acquire(500)
+    budget.release(100)
+    assert 0 == budget.stats()['reserved_bytes']
+
+
+def test_memory_budget_queues_until_release():
+    budget = server.MemoryBudget(100, 1, 5)
+    budget.acquire(80)
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(budget.acquire(50)))
+    waiter.start()
+
+    while budget.stats()['waiting'] == 0:
+        time.sleep(0.01)
+    assert [] == admitted
+
+    budget.release(80)
+    waiter.join(5)
+    assert [50] == admitted
+    assert 50 == budget.stats()['reserved_bytes']
+
+
+def test_memory_budget_rejects_when_queue_is_full():
+    budget = server.MemoryBudget(100, 0, 5)
+    budget.acquire(80)
+    with pytest.raises(server.MemoryBudgetExceeded):
+        budget.acquire(50)
+    assert 1 == budget.stats()['rejected']
+
+
+def test_memory_budget_rejects_after_wait_timeout():
+    budget = server.MemoryBudget(100, 1, 0.05)
+    budget.acquire(80)
+    with pytest.raises(server.MemoryBudgetExceeded):
+        budget.acquire(50)
+    assert 0 == budget.stats()['waiting']
+    assert 80 == budget.stats()['reserved_bytes']
+
+
+def test_submit_returns_503_when_memory_budget_is_exhausted(client, monkeypatch):
+    budget = server.MemoryBudget(100, 0, 0)
+    budget.acquire(100)
+    monkeypatch.setattr(server, 'memory_budget', budget)
+
+    response = client.post('/submit-encrypted-data', json={})
+
+    assert 503 == response.status_code
+    assert str(server.Config.MEMORY_BUDGET_RETRY_AFTER) == response.headers['Retry-After']
+    assert 'failure' == response.json['status']
+
+
+def test_profiling_is_hidden_without_token(client, monkeypatch):
+    monkeypatch.setattr(server.Config, 'PROFILING_TOKEN', '')
+    assert 404 == client.get('/profiling').status_code
+    assert 404 == client.get('/profiling/some.folded').status_code
+
+
+def test_profiling_rejects_wrong_token(client, monkeypatch):
+    monkeypatch.setattr(server.Config, 'PROFILING_TOKEN', 'secret-token')
+    assert 401 == client.get('/profiling').status_code
+    assert 401 == client.get('/profiling', headers={'Authorization': 'Bearer wrong-token'}).status_code
+    assert 401 == client.get('/profiling/some.folded', headers={'Authorization': 'Bearer wrong-token'}).status_code
+
+
+def test_profiling_accepts_bearer_token(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(server.Config, 'PROFILING_TOKEN', 'secret-token')
+    monkeypatch.setattr(server.Config, 'PROFILING_DIR', str(tmp_path))
+    (tmp_path / 'some.folded').write_text('request;submit 1\n')
+    headers = {'Authorization': 'Bearer secret-token'}
+
+    response = client.get('/profiling', headers=headers)
+    assert 200 == response.status_code
+    assert ['some.folded'] == response.json['profiles']
+
+    response = client.get('/profiling/some.folded', headers=headers)
+    assert 200 == response.status_code
+    assert b'request;submit 1\n' == response.data
+
+
+@pytest.fixture
+def profiling_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(server.Config, 'PROFILING_TOKEN', 'secret-token')
+    monkeypatch.setattr(server.Config, 'PROFILING_DIR', str(tmp_path))
+    monkeypatch.setattr(server.Config, 'PROFILING_SAMPLE_RATE', 0.0)
+    monkeypatch.setattr(server, 'profiling_settings', {'sample_rate': 0.0, 'mtime': None})
+    return tmp_path
+
+
+def run_profiled_stage(profiler, stage):
+    profiler.start()
+    try:
+        with profiler.stage(stage):
+            data = [str(i) * 10 for i in range(20000)]
+            deadline = time.perf_counter() + 0.05
+            while time.perf_counter() < deadline:
+                sum(range(1000))
+    finally:
+        profiler.stop()
+    return data
+
+
+def test_request_profiler_saves_folded_stacks_and_allocations_per_stage(profiling_dir):
+    profiler = server.RequestProfiler(threading.get_ident(), 0.001)
+    run_profiled_stage(profiler, 'create_email')
+
+    name = profiler.save(str(profiling_dir))
+
+    folded = (profiling_dir / f'{name}.folded').read_text().splitlines()
+    assert folded
+    assert any(line.startswith('create_email;') and 'run_profiled_stage' in line for line in folded)
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in folded)
+    allocations = (profiling_dir / f'{name}.alloc.txt').read_text()
+    assert allocations.startswith('== create_email (')
+    assert 'test_server.py' in allocations
+
+
+def test_request_profiler_prunes_oldest_profiles(profiling_dir, monkeypatch):
+    monkeypatch.setattr(server.Config, 'PROFILING_MAX_FILES', 4)
+    server.set_profiling_sample_rate(0.5)
+    names = []
+    for _ in range(3):
+        profiler = server.RequestProfiler(threading.get_ident(), 0.001)
+        run_profiled_stage(profiler, 'send_email')
+        names.append(profiler.save(str(profiling_dir)))
+
+    expected = sorted(f'{name}{suffix}' for name in names[1:] for suffix in server.PROFILE_SUFFIXES)
+    assert expected == server.list_profiles(str(profiling_dir))
+    # The shared sample rate is not a profile and is never pruned
+    assert (profiling_dir / server.PROFILING_RATE_FILE).exists()
+
+
+def test_tracemalloc_runs_while_any_profiled_request_is_active():
+    first = server.RequestProfiler(threading.get_ident(), 0.01)
+    second = server.RequestProfiler(threading.get_ident(), 0.01)
+    first.start()
+    second.start()
+    first.stop()
+    assert tracemalloc.is_tracing()
+    second.stop()
+    assert not tracemalloc.is_tracing()
+
+
+def test_profiling_sample_rate_is_shared_through_profiling_dir(client, profiling_dir):
+    headers = {'Authorization': 'Bearer secret-token'}
+
+    response = client.post('/profiling', json={'sample_rate': 0.25}, headers=headers)
+    assert 200 == response.status_code
+    assert 0.25 == response.json['sample_rate']
+
+    # Another worker has its own cache and picks the rate up from the file
+    server.profiling_settings.update(sample_rate=0.0, mtime=None)
+    assert 0.25 == server.get_profiling_sample_rate()
+    assert 0.25 == client.get('/profiling', headers=headers).json['sample_rate']
+
+    client.post('/profiling', json={'sample_rate': 0}, headers=headers)
+    assert 0 == server.get_profiling_sample_rate()
+
+
+@pytest.mark.parametrize('payload', [{'sample_rate': 1.5}, {'sample_rate': -0.1}, {'sample_rate': 'often'}, {'sample_rate': None}, [0.5]])
+def test_profiling_rejects_invalid_sample_rate(client, profiling_dir, payload):
+    response = client.post('/profiling', json=payload, headers={'Authorization': 'Bearer secret-token'})
+
+    assert 400 == response.status_code
+    assert 0.0 == server.get_profiling_sample_rate()
+    assert not (profiling_dir / server.PROFILING_RATE_FILE).exists()
+
+def test_readiness_is_starting_before_first_probe_round():
+    monitor = server.ReadinessMonitor({'ses': (lambda: {'ok': True}, True)}, 30, 90)
+    ready, body = monitor.status()
+    assert not ready
+    assert {'status': 'starting'} == body
+
+
+def test_readiness_ignores_failing_non_critical_probes():
+    monitor = server.ReadinessMonitor({
+        'ses': (lambda: {'ok': True}, True),
+        'kissflow': (lambda: {'ok': False}, False),
+    }, 30, 90)
+    monitor.refresh()
+    ready, body = monitor.status()
+    assert ready
+    assert 'ready' == body['status']
+    assert not body['probes']['kissflow']['ok']
+    assert 'latency_ms' in body['probes']['ses']
+
+
+def test_readiness_fails_on_critical_probe_error():
+    def failing_probe():
+        raise ConnectionError('unreachable')
+
+    monitor = server.ReadinessMonitor({'turnstile': (failing_probe, True)}, 30, 90)
+    monitor.refresh()
+    ready, body = monitor.status()
+    assert not ready
+    assert 'unready' == body['status']
+    assert 'unreachable' == body['probes']['turnstile']['error']
+
+
+def test_readiness_fails_on_stale_snapshot():
+    monitor = server.ReadinessMonitor({'ses': (lambda: {'ok': True}, True)}, 30, 90)
+    monitor.refresh()
+    monitor.snapshot['checked_at'] -= 91
+    ready, body = monitor.status()
+    assert not ready
+    assert 'unready' == body['status']
+
+
+@pytest.fixture
+def submission_client(client, monkeypatch):
+    """
+    Client whose submissions skip Turnstile and capture the emails instead of sending them.
+    """
+    sent = []
+    monkeypatch.setattr(server, 'validate_turnstile', lambda turnstile_response, deadline=None: None)
+    monkeypatch.setattr(server, 'send_email', lambda message, deadline=None: sent.append(message))
+    client.sent = sent
+    return client
+
+
+def test_submit_accepts_gzip_encoded_body(submission_client):
+    data = {'cf-turnstile-response': 'token', 'message': 'encrypted', 'recipient': 'devcon', 'files': [{'filename': 'a.txt', 'attachment': 'encrypted_a'}]}
+
+    response = submission_client.post('/submit-encrypted-data', data=gzip.compress(json.dumps(data).encode()), headers={'Content-Type': 'application/json', 'Content-Encoding': ' GZIP '})
+
+    assert 'success' == response.json['status']
+    body, attachment = submission_client.sent[0].get_payload()
+    assert 'encrypted' == body.get_payload()
+    assert b'encrypted_a' == attachment.get_payload(decode=True)
+
+
+def test_submit_rejects_gzip_bomb(submission_client, monkeypatch):
+    monkeypatch.setattr(server.Config, 'MAX_CONTENT_LENGTH', 1000)
+
+    response = submission_client.post('/submit-encrypted-data', data=gzip.compress(b' ' * 100000), headers={'Content-Encoding': 'gzip'})
+
+    assert 413 == response.status_code
+    assert [] == submission_client.sent
+
+
+def test_submit_rejects_corrupt_gzip(submission_client):
+    truncated = gzip.compress(b'{"message": "encrypted"}')[:-10]
+
+    assert 400 == submission_client.post('/submit-encrypted-data', data=b'not gzip', headers={'Content-Encoding': 'gzip'}).status_code
+    assert 400 == submission_client.post('/submit-encrypted-data', data=truncated, headers={'Content-Encoding': 'gzip'}).status_code
+
+
+def test_submit_rejects_unknown_encoding(submission_client):
+    response = submission_client.post('/submit-encrypted-data', data=b'{}', headers={'Content-Encoding': 'br'})
+    assert 415 == response.status_code
+
+
+def compressed_submission(size):
+    data = {'cf-turnstile-response': 'token', 'message': 'a' * size, 'recipient': 'devcon', 'files': []}
+    decoded = json.dumps(data).encode()
+    return decoded, gzip.compress(decoded)
+
+
+def test_compressed_submission_reservation_tracks_decoded_size(submission_client, monkeypatch):
+    budget = server.MemoryBudget(10 * 1024 * 1024, 0, 0)
+    monkeypatch.setattr(server, 'memory_budget', budget)
+    reserved_while_sending = []
+    monkeypatch.setattr(server, 'send_email', lambda message, deadline=None: reserved_while_sending.append(budget.stats()['reserved_bytes']))
+    decoded, encoded = compressed_submission(100000)
+
+    response = submission_client.post('/submit-encrypted-data', data=encoded, headers={'Content-Encoding': 'gzip'})
+
+    assert 'success' == response.json['status']
+    assert [len(decoded) * server.Config.MEMORY_BUDGET_COPIES] == reserved_while_sending
+    assert 0 == budget.stats()['reserved_bytes']
+
+
+def test_compressed_submission_is_rejected_when_decoded_size_does_not_fit(submission_client, monkeypatch):
+    decoded, encoded = compressed_submission(100000)
+    budget = server.MemoryBudget(10 * 1024 * 1024, 0, 0)
+    # Leave room for the compressed body but not for the decoded one
+    budget.acquire(budget.capacity - len(encoded) * server.Config.MEMORY_BUDGET_COPIES)
+    monkeypatch.setattr(server, 'memory_budget', budget)
+
+    response = submission_client.post('/submit-encrypted-data', data=encoded, headers={'Content-Encoding': 'gzip'})
+
+    assert 503 == response.status_code
+    assert str(server.Config.MEMORY_BUDGET_RETRY_AFTER) == response.headers['Retry-After']
+    assert [] == submission_client.sent
+    assert budget.capacity - len(encoded) * server.Config.MEMORY_BUDGET_COPIES == budget.stats()['reserved_bytes']
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(time, 'monotonic', fake)
+    return fake
+
+
+def test_get_timeout_is_bounded_by_deadline(clock):
+    deadline = server.Deadline(10)
+    assert 5 == server.get_timeout(deadline, 5)
+    clock.now += 8
+    assert 2 == server.get_timeout(deadline, 5)
+    clock.now += 2
+    with pytest.raises(server.DeadlineExceeded):
+        server.get_timeout(deadline, 5)
+    assert 5 == server.get_timeout(None, 5)
+
+
+def test_circuit_breaker_opens_after_consecutive_failures(clock):
+    breaker = server.CircuitBreaker('Test', 2, 30)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert 'closed' == breaker.state()
+    breaker.before_call()
+
+    breaker.record_failure()
+    assert 'open' == breaker.state()
+    with pytest.raises(server.CircuitOpen):
+        breaker.before_call()
+
+
+def test_circuit_breaker_lets_single_trial_through_and_closes(clock):
+    breaker = server.CircuitBreaker('Test', 1, 30)
+    breaker.record_failure()
+    clock.now += 30
+    assert 'half-open' == breaker.state()
+
+    breaker.before_call()
+    with pytest.raises(server.CircuitOpen):
+        breaker.before_call()
+
+    breaker.record_success()
+    assert 'closed' == breaker.state()
+    breaker.before_call()
+
+
+def test_circuit_breaker_reopens_when_trial_fails(clock):
+    breaker = server.CircuitBreaker('Test', 1, 30)
+    breaker.record_failure()
+    clock.now += 30
+    breaker.before_call()
+
+    breaker.record_failure()
+    clock.now += 29
+    assert 'open' == breaker.state()
+    with pytest.raises(server.CircuitOpen):
+        breaker.before_call()
+
+
+def test_expired_deadline_does_not_take_kissflow_trial(clock, monkeypatch):
+    breaker = server.CircuitBreaker('Kissflow', 1, 30)
+    monkeypatch.setattr(server, 'kissflow_breaker', breaker)
+    breaker.record_failure()
+    clock.now += 30
+    deadline = server.Deadline(-1)
+
+    with pytest.raises(server.DeadlineExceeded):
+        server.kissflow_request('GET', 'http://127.0.0.1:1/', deadline)
+    assert 'half-open' == breaker.state()
+
+
+def test_kissflow_update_is_skipped_while_breaker_is_open(clock, monkeypatch):
+    breaker = server.CircuitBreaker('Kissflow', 1, 30)
+    monkeypatch.setattr(server, 'kissflow_breaker', breaker)
+    monkeypatch.setattr(server, 'find_aog_item_by_grant_id', lambda grant_id, deadline=None: pytest.fail('Kissflow was called'))
+    breaker.record_failure()
+
+    assert not server.send_identifier_to_kissflow('GRANT-1', 'legal:2025:01:01:00:00:00:1234')
+
+
+def test_send_email_refuses_to_start_without_enough_budget(monkeypatch):
+    monkeypatch.setattr(server, 'ses_client', None)
+    message = server.create_email('someone@somewhere.org', 'just:some:identifier', 'text', [])
+    deadline = server.Deadline(server.Config.SES_CONNECT_TIMEOUT + server.Config.SES_TIMEOUT - 1)
+
+    with pytest.raises(server.DeadlineExceeded):
+        server.send_email(message, deadline)
+
+
+class StubSesClient:
+    def __init__(self, error_code=None):
+        self.error_code = error_code
+        self.sent = []
+
+    def send_email(self, **kwargs):
+        if self.error_code:
+            raise ClientError({'Error': {'Code': self.error_code, 'Message': 'stub error'}}, 'SendEmail')
+        self.sent.append(kwargs)
+        return {'MessageId': 'stub-message-id'}
+
+
+def test_slow_upload_does_not_count_against_submission_deadline(client, clock, monkeypatch):
+    ses = StubSesClient()
+    monkeypatch.setattr(server, 'ses_client', ses)
+    monkeypatch.setattr(server, 'validate_turnstile', lambda turnstile_response, deadline=None: None)
+    read_request_body = server.read_request_body
+
+    def slow_read_request_body():
+        clock.now += server.Config.SUBMISSION_DEADLINE
+        return read_request_body()
+
+    monkeypatch.setattr(server, 'read_request_body', slow_read_request_body)
+    data = {'cf-turnstile-response': 'token', 'message': 'encrypted', 'recipient': 'devcon', 'files': []}
+
+    response = client.post('/submit-encrypted-data', json=data)
+
+    assert 'success' == response.json['status']
+    assert 1 == len(ses.sent)
+
+
+def test_ses_throttling_does_not_open_breaker(monkeypatch):
+    breaker = server.CircuitBreaker('SES', 1, 30)
+    monkeypatch.setattr(server, 'ses_breaker', breaker)
+    monkeypatch.setattr(server, 'ses_client', StubSesClient('TooManyRequestsException'))
+    message = server.create_email('someone@somewhere.org', 'just:some:identifier', 'text', [])
+
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            server.send_email(message)
+    assert 'closed' == breaker.state()
+
+    monkeypatch.setattr(server, 'ses_client', StubSesClient('InternalFailure'))
+    with pytest.raises(ValueError):
+        server.send_email(message)
+    assert 'open' == breaker.state()
+
+
+def test_submit_reports_open_ses_breaker(client, monkeypatch):
+    breaker = server.CircuitBreaker('SES', 1, 30)
+    breaker.record_failure()
+    monkeypatch.setattr(server, 'ses_breaker', breaker)
+    monkeypatch.setattr(server, 'ses_client', StubSesClient())
+    monkeypatch.setattr(server, 'validate_turnstile', lambda turnstile_response, deadline=None: None)
+    data = {'cf-turnstile-response': 'token', 'message': 'encrypted', 'recipient': 'devcon', 'files': []}
+
+    response = client.post('/submit-encrypted-data', json=data)
+
+    assert 503 == response.status_code
+    assert 'temporarily unavailable' in response.json['message']